@@ -4,11 +4,13 @@ of independent variables to another.
 """
 
 from .imports import *
+from scipy.sparse import csr_matrix
 
 __all__ = [
     "bintoR",
     "bintogrid",
     "resample_while_conserving_flux",
+    "calculate_resampling_matrix",
     "leftright_to_edges",
     "edges_to_leftright",
     "calculate_bin_leftright",
@@ -354,6 +356,57 @@ def resample_while_conserving_flux(
     return {"x": xout, "x_edge_lower": xout_left, "x_edge_upper": xout_right, "y": yout}
 
 
+def calculate_resampling_matrix(xin_edges, xout_edges):
+    """
+    Calculate a sparse matrix that resamples values from
+    one grid of bins onto another, while conserving flux.
+
+    For fixed input and output grids, the resampling done
+    by `resample_while_conserving_flux` is linear, so
+    `yout = matrix @ yin` gives the same result. This
+    is much faster when lots of different `yin` arrays
+    need to be resampled between the same two grids.
+
+    Parameters
+    ----------
+    xin_edges : array
+        The N+1 edges of the original independent variable
+        bins, sorted to be strictly increasing.
+    xout_edges : array
+        The M+1 edges of the new grid of bins for the
+        independent variable, sorted to be strictly increasing.
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        A matrix with shape (M, N), where element [m, i]
+        is the fraction of original bin i that falls
+        into new bin m.
+    """
+
+    xin_left, xin_right = edges_to_leftright(np.asarray(xin_edges))
+    xout_edges = np.asarray(xout_edges)
+    N, M = len(xin_left), len(xout_edges) - 1
+
+    # find the range of new bins that each original bin might overlap
+    first = np.clip(np.searchsorted(xout_edges, xin_left, side="right") - 1, 0, M - 1)
+    last = np.clip(np.searchsorted(xout_edges, xin_right, side="left") - 1, 0, M - 1)
+    n = np.maximum(last - first + 1, 1)
+
+    # list every (new bin, original bin) pair that might overlap
+    cols = np.repeat(np.arange(N), n)
+    offsets = np.arange(np.sum(n)) - np.repeat(np.cumsum(n) - n, n)
+    rows = np.repeat(first, n) + offsets
+
+    # calculate what fraction of each original bin lands in each new bin
+    left = np.maximum(xout_edges[rows], xin_left[cols])
+    right = np.minimum(xout_edges[rows + 1], xin_right[cols])
+    fraction = np.maximum(right - left, 0) / (xin_right - xin_left)[cols]
+
+    ok = fraction > 0
+    return csr_matrix((fraction[ok], (rows[ok], cols[ok])), shape=(M, N))
+
+
 def bintogrid(
     x=None,
     y=None,
@@ -1,9 +1,144 @@
 from ..imports import *
-from ..resampling import bintoR, bintogrid
+from ..resampling import (
+    bintogrid,
+    calculate_bin_leftright,
+    leftright_to_edges,
+    calculate_resampling_matrix,
+)
 from ..version import __version__
 import astropy.config.paths
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import contextlib, hashlib, itertools, queue, shutil, threading, urllib.request, zipfile
 from astropy.utils.data import is_url_in_cache, cache_total_size
 
+# fitsio reads the raw PHOENIX files faster than astropy, but isn't required
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
+
+# numba speeds up interpolating between spectra, but isn't required
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _fast_read_phoenix(filename):
+    """
+    Read the data from a simple PHOENIX FITS file, skipping
+    all the general-purpose machinery of a full FITS reader.
+
+    The raw PHOENIX files each contain a single 1D floating-point
+    image in the primary HDU, so we only need to step through
+    the 2880-byte header blocks until we find the END card,
+    and then read the array that starts right after it.
+
+    Parameters
+    ----------
+    filename : str
+        The filename of the raw PHOENIX FITS file.
+
+    Returns
+    -------
+    data : array
+        The 1D data array, in native byte order.
+    """
+    block, card = 2880, 80
+    header = {}
+    with open(filename, "rb") as f:
+        while "END" not in header:
+            chunk = f.read(block)
+            if len(chunk) < block:
+                raise ValueError(f"No END card found in the header of {filename}")
+            for start in range(0, block, card):
+                keyword = chunk[start : start + 8].decode("ascii").strip()
+                if keyword == "END":
+                    header["END"] = True
+                    break
+                if chunk[start + 8 : start + 10] == b"= ":
+                    value = chunk[start + 10 : start + card].decode("ascii")
+                    header[keyword] = value.split("/")[0].strip()
+
+        # make sure this is the simple case we know how to read
+        dtypes = {"-32": ">f4", "-64": ">f8"}
+        scaled = float(header.get("BSCALE", 1)) != 1 or float(header.get("BZERO", 0))
+        if header.get("NAXIS") != "1" or header.get("BITPIX") not in dtypes or scaled:
+            raise ValueError(f"{filename} is not a simple 1D floating-point image")
+        dtype = np.dtype(dtypes[header["BITPIX"]])
+        count = int(header["NAXIS1"])
+
+        data = np.fromfile(f, dtype=dtype, count=count)
+    if len(data) != count:
+        raise ValueError(f"{filename} is shorter than its header says")
+    return data.astype(dtype.newbyteorder("="))
+
+
+def _interpolate_log_spectra_numpy(
+    spectra, weight_temperature, weight_logg, weight_metallicity
+):
+    """
+    Interpolate among a block of neighboring grid spectra,
+    linearly in log(flux).
+
+    Parameters
+    ----------
+    spectra : array
+        The grid spectra, with shape
+        (temperature, logg, metallicity, wavelength)
+    weight_temperature : array
+        The interpolation weights along the temperature axis.
+    weight_logg : array
+        The interpolation weights along the logg axis.
+    weight_metallicity : array
+        The interpolation weights along the metallicity axis.
+
+    Returns
+    -------
+    spectrum : array
+        The interpolated spectrum.
+    """
+    # accumulate one grid spectrum at a time, reusing the same buffers
+    spectrum = np.zeros(spectra.shape[-1])
+    temporary = np.empty(spectra.shape[-1])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for i, j, k in np.ndindex(spectra.shape[:-1]):
+            weight = weight_temperature[i] * weight_logg[j] * weight_metallicity[k]
+            np.log(spectra[i, j, k], out=temporary, dtype=float)
+            temporary *= weight
+            spectrum += temporary
+        return np.exp(spectrum, out=spectrum)
+
+
+if njit is not None:
+    # the same calculation, as one compiled pass over wavelength
+    # (fast math, except for assuming there are no nans or infs)
+    @njit(cache=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+    def _interpolate_log_spectra_numba(
+        spectra, weight_temperature, weight_logg, weight_metallicity
+    ):
+        spectrum = np.empty(spectra.shape[-1])
+        for w in range(spectra.shape[-1]):
+            total = 0.0
+            for i in range(spectra.shape[0]):
+                for j in range(spectra.shape[1]):
+                    for k in range(spectra.shape[2]):
+                        weight = (
+                            weight_temperature[i]
+                            * weight_logg[j]
+                            * weight_metallicity[k]
+                        )
+                        total += weight * np.log(np.float64(spectra[i, j, k, w]))
+            spectrum[w] = np.exp(total)
+        return spectrum
+
+    _interpolate_log_spectra = _interpolate_log_spectra_numba
+else:
+    _interpolate_log_spectra_numba = None
+    _interpolate_log_spectra = _interpolate_log_spectra_numpy
+
 
 class PHOENIXLibrary:
     # downloaded files will be stored in "~/.{_cache_label}"
@@ -26,11 +161,47 @@ class PHOENIXLibrary:
         100000,
     ]
 
+    # multiply raw PHOENIX spectra by this to convert them to W/(m**2 nm)
+    # (as a python float, so it doesn't upcast the float32 raw data)
+    _raw_spectrum_to_W_per_m2_per_nm = float(
+        (1 * u.Unit("erg/(s * cm**2 * cm)")).to("W/(m**2 nm)").value
+    )
+
+    # compressed grids bigger than this (in bytes, once uncompressed) get
+    # uncompressed to disk to be memory-mapped, instead of loaded into memory
+    _maximum_grid_size_to_load_into_memory = 200e6
+
     def get_cache_dir(self):
         return astropy.config.paths.get_cache_dir(self._cache_label)
 
+    def _get_uncompressed_grid_dir(self):
+        return os.path.join(self.get_cache_dir(), "uncompressed")
+
     def get_cache_size(self):
-        return (cache_total_size(self._cache_label) * u.byte).to(u.gigabyte)
+        """
+        Get the disk space used by downloaded files, including
+        uncompressed copies of large grids (which aren't part of
+        astropy's download cache, and so need to be cleared with
+        `.clear_uncompressed_grids()`).
+
+        Returns
+        -------
+        size : Quantity
+            The total size of the cached files.
+        """
+        uncompressed = glob.glob(os.path.join(self._get_uncompressed_grid_dir(), "*"))
+        size = cache_total_size(self._cache_label) + sum(
+            os.path.getsize(f) for f in uncompressed
+        )
+        return (size * u.byte).to(u.gigabyte)
+
+    def clear_uncompressed_grids(self):
+        """
+        Delete the uncompressed copies of large grids.
+        (They will be made again from the compressed
+        grids the next time they're needed.)
+        """
+        shutil.rmtree(self._get_uncompressed_grid_dir(), ignore_errors=True)
 
     def __init__(self, directory=".", photons=True):
         """
@@ -64,6 +235,7 @@ class PHOENIXLibrary:
         )
 
         self._local_paths = {}
+        self._urls_not_online = set()
 
     def _download_grid(self, R, metallicity=0.0, cache=True):
         """
@@ -98,15 +270,25 @@ class PHOENIXLibrary:
         # make sure it's a possible R
         assert R in self._available_resolutions
 
-        # download (or find the cached local file)
-        basename = self._get_grid_filename(R, metallicity=metallicity)
-        url = f"https://casa.colorado.edu/~bertathompson/chromatic/{basename}"
+        # newer grids are compressed, but older ones might be all that's online
+        urls = {
+            compressed: "https://casa.colorado.edu/~bertathompson/chromatic/"
+            + self._get_grid_filename(R, metallicity=metallicity, compressed=compressed)
+            for compressed in [True, False]
+        }
 
-        if is_url_in_cache(url, pkgname=self._cache_label):
+        # use a cached local file if there is one, without going online
+        cached = [
+            c for c in urls if is_url_in_cache(urls[c], pkgname=self._cache_label)
+        ]
+        if len(cached) > 0:
+            compressed = cached[0]
             self._local_paths[R] = download_file(
-                url, pkgname=self._cache_label, cache=True
+                urls[compressed], pkgname=self._cache_label, cache=True
             )
         else:
+            compressed = self._is_url_online(urls[True])
+            url = urls[compressed]
 
             threshold = 1000
             if R <= threshold:
@@ -124,9 +306,37 @@ class PHOENIXLibrary:
             self._local_paths[R] = download_file_with_warning(
                 url, pkgname=self._cache_label, cache=cache, show_progress=True
             )
+
         return self._local_paths[R]
 
-    def _download_raw_data(self, metallicity=0.0, cache=True):
+    def _is_url_online(self, url, timeout=10):
+        """
+        Check whether a file exists online, without downloading it.
+        (Files that are missing are remembered for this session.)
+
+        Parameters
+        ----------
+        url : str
+            The URL of the file.
+        timeout : float
+            How many seconds should we wait for the server?
+
+        Returns
+        -------
+        online : bool
+            Does the file exist at that URL?
+        """
+        if url in self._urls_not_online:
+            return False
+        try:
+            request = urllib.request.Request(url, method="HEAD")
+            with urllib.request.urlopen(request, timeout=timeout):
+                return True
+        except OSError:
+            self._urls_not_online.add(url)
+            return False
+
+    def _download_raw_data(self, metallicity=0.0, cache=True, max_workers=8):
         """
         Make sure the raw data from the online PHOENIX database
         are downloaded to your local computer. (Most users
@@ -136,6 +346,65 @@ class PHOENIXLibrary:
         You must be connected to the internet for this to work.
         It may take quite a long time!
 
+        Parameters
+        ----------
+        metallicity : float
+            The stellar metallicity (= log10[metals/solar])
+        cache : bool
+            Once it's downloaded, should we keep it for next time?
+        max_workers : int
+            How many files should we download at once? (Keep
+            this modest, to avoid being throttled by the server.)
+        """
+
+        self._download_raw_index(metallicity=metallicity, cache=cache)
+        N = len(self._raw_spectrum_urls)
+        cheerfully_suggest(
+            f"""
+        Downloading (or finding locally) {N} very large files from
+        {self._raw_directory_url}
+
+        If the files aren't already downloaded,
+        this might take an annoyingly long time!
+        If it crashes due to a timeout,
+        try restarting.
+        """
+        )
+
+        # download in parallel (individual progress bars would overlap, so skip them)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    download_file,
+                    url,
+                    pkgname=self._cache_label,
+                    cache=cache,
+                    show_progress=False,
+                ): file
+                for url, file in zip(
+                    self._raw_spectrum_urls, self._raw_spectrum_filenames
+                )
+            }
+            downloaded = {}
+            try:
+                for future in tqdm(as_completed(futures), total=N, leave=False):
+                    downloaded[futures[future]] = future.result()
+            except BaseException:
+                # don't wait for all the other downloads before giving up
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # keep the files in the same order as the index
+        for file in self._raw_spectrum_filenames:
+            self._raw_downloaded[file] = downloaded[file]
+
+    def _download_raw_index(self, metallicity=0.0, cache=True):
+        """
+        Make sure the shared wavelength array and the index of
+        spectrum files from the online PHOENIX database are
+        downloaded to your local computer (but not the spectra).
+
         Parameters
         ----------
         metallicity : float
@@ -197,26 +466,75 @@ class PHOENIXLibrary:
             "/".join([self._raw_base_url, self._raw_directory, f])
             for f in self._raw_spectrum_filenames
         ]
-        N = len(self._raw_spectrum_urls)
-        cheerfully_suggest(
-            f"""
-        Downloading (or finding locally) {N} very large files from
-        {self._raw_directory_url}
-
-        If the files aren't already downloaded,
-        this might take an annoyingly long time!
-        If it crashes due to a timeout,
-        try restarting.
-        """
-        )
         self._current_raw_metallicity = metallicity
         self._raw_downloaded = {}
-        for url, file in tqdm(
-            zip(self._raw_spectrum_urls, self._raw_spectrum_filenames), leave=False
-        ):
-            self._raw_downloaded[file] = download_file_with_warning(
-                url, pkgname=self._cache_label, cache=cache
-            )
+
+    def _load_raw_spectra_in_background(self, cache=True, max_workers=8, maxsize=16):
+        """
+        Download (or find locally) and load all the raw spectra
+        for the current metallicity, using background threads
+        so that downloading can overlap with whatever is being
+        done with the spectra that have already arrived.
+
+        Parameters
+        ----------
+        cache : bool
+            Once it's downloaded, should we keep it for next time?
+        max_workers : int
+            How many files should we download at once? (Keep
+            this modest, to avoid being throttled by the server.)
+        maxsize : int
+            How many loaded spectra can be waiting to be used,
+            before the downloads pause? (This limits memory.)
+
+        Yields
+        ------
+        filename : str
+            The filename of the raw PHOENIX spectrum.
+        spectrum : array
+            The spectrum in units of W/(m**2 nm),
+            but without astropy units attached.
+        """
+        ready = queue.Queue(maxsize=maxsize)
+        stop = threading.Event()
+
+        def download_and_load(url, file):
+            try:
+                path = self._raw_downloaded.get(file)
+                if path is None:
+                    path = download_file(
+                        url, pkgname=self._cache_label, cache=cache, show_progress=False
+                    )
+                item = file, path, self._load_raw_spectrum(path)
+            except Exception as e:
+                item = e
+
+            # wait for space in the queue (unless we've given up)
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [
+            executor.submit(download_and_load, url, file)
+            for url, file in zip(self._raw_spectrum_urls, self._raw_spectrum_filenames)
+        ]
+        try:
+            for _ in self._raw_spectrum_filenames:
+                item = ready.get()
+                if isinstance(item, Exception):
+                    raise item
+                file, path, spectrum = item
+                self._raw_downloaded[file] = path
+                yield file, spectrum
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
 
     def _load_raw_wavelength(self):
         """
@@ -229,19 +547,25 @@ class PHOENIXLibrary:
             with astropy units of microns.
         """
 
-        # default to the preloaded raw wavelength
+        # default to the preloaded raw wavelength (attaching units without a copy)
         try:
-            return self._raw_wavelength
+            return self._raw_wavelength_micron << u.micron
 
         # load the raw wavelengths and save them for next time
         except AttributeError:
             wavelength_filename = self._raw_local_paths["wavelengths"]
-            hdu = fits.open(wavelength_filename)
-            wavelength_without_unit = hdu[0].data
-            wavelength_unit = u.Angstrom
-            wavelength = wavelength_without_unit * wavelength_unit
-            self._raw_wavelength = wavelength.to("micron")
-            return self._raw_wavelength
+            try:
+                wavelength_without_unit = _fast_read_phoenix(wavelength_filename)
+            except ValueError:
+                if fitsio is None:
+                    with fits.open(wavelength_filename, memmap=False) as hdus:
+                        wavelength_without_unit = hdus[0].data.copy()
+                else:
+                    wavelength_without_unit = fitsio.read(wavelength_filename)
+
+            # keep a plain array in microns (the raw files are in Angstroms)
+            self._raw_wavelength_micron = wavelength_without_unit * 1e-4
+            return self._raw_wavelength_micron << u.micron
 
     def _load_raw_spectrum(self, filename):
         """
@@ -253,16 +577,23 @@ class PHOENIXLibrary:
             The filename of the raw PHOENIX spectrum
         Returns
         -------
-        spectrum : Quantity
-            The spectrum, with astropy units of W/(m**2 nm)
+        spectrum : array
+            The spectrum in units of W/(m**2 nm),
+            but without astropy units attached.
         """
-        hdus = fits.open(filename)
-        flux_without_unit = hdus[0].data
-        flux_unit = u.Unit("erg/(s * cm**2 * cm)")
-        flux = flux_without_unit * flux_unit
-        return flux.to("W/(m**2 nm)")
+        try:
+            flux_without_unit = _fast_read_phoenix(filename)
+        except ValueError:
+            if fitsio is None:
+                with fits.open(filename, memmap=False) as hdus:
+                    flux_without_unit = hdus[0].data.copy()
+            else:
+                flux_without_unit = fitsio.read(filename)
+        return flux_without_unit * self._raw_spectrum_to_W_per_m2_per_nm
 
-    def _stringify_metallicity(self, metallicity):
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _stringify_metallicity(metallicity):
         """
         Convert a metallicity into a PHOENIX-style string.
 
@@ -327,10 +658,9 @@ class PHOENIXLibrary:
             The filename of PHOENIX model (excluding directory).
         """
 
-        f"lte{temperature:05.0f}-{logg:04.2f}{self._stringify_metallicity(metallicity)}.PHOENIX-ACES-AGSS-COND-2011-HiRes.fits"
-        return f
+        return f"lte{temperature:05.0f}-{logg:04.2f}{self._stringify_metallicity(metallicity)}.PHOENIX-ACES-AGSS-COND-2011-HiRes.fits"
 
-    def _get_grid_filename(self, R, metallicity=0.0):
+    def _get_grid_filename(self, R, metallicity=0.0, compressed=False):
         """
         Get the filename of a pre-processed grid.
 
@@ -340,6 +670,9 @@ class PHOENIXLibrary:
             The resolution of the grid.
         metallicity : float
             The stellar metallicity.
+        compressed : bool
+            Should this be the filename of a compressed grid
+            (with its metadata inside), or of an older one?
 
         Returns
         -------
@@ -351,7 +684,8 @@ class PHOENIXLibrary:
         else:
             unit_string = "flux"
 
-        filename = f"phoenix_{unit_string}_metallicity={metallicity:3.1f}_R={R:.0f}.npy"
+        extension = "npz" if compressed else "npy"
+        filename = f"phoenix_{unit_string}_metallicity={metallicity:3.1f}_R={R:.0f}.{extension}"
         return filename
 
     def _create_grids(self, remake=False):
@@ -384,11 +718,52 @@ class PHOENIXLibrary:
         command : string
             A copy-paste `rsync` command to upload new files.
         """
-        source = os.path.join(self._directory_for_new_grids, "phoenix_*.npy")
+        source = os.path.join(self._directory_for_new_grids, "phoenix_*.np[yz]")
         command = f"rsync -v --progress {source} {destination}"
         return command
 
-    def _create_grid(self, R, metallicity=0.0, remake=False):
+    def _create_binning_matrix(self, unbinned_w, R, ok=None):
+        """
+        Create the matrix that bins raw spectra onto a
+        logarithmically uniform grid, the same way as
+        `bintoR(unbinned_w, unbinned_f, R=R, drop_nans=False)`.
+
+        Parameters
+        ----------
+        unbinned_w : Quantity
+            The raw wavelength array.
+        R : float
+            The resolution of the grid.
+        ok : array, optional
+            Which raw pixels should be included? Like `bintoR`,
+            the edges of the remaining pixels get recalculated
+            from their centers, so they stretch across any gaps.
+
+        Returns
+        -------
+        w : Quantity
+            The wavelengths of the binned grid.
+        matrix : scipy.sparse.csr_matrix
+            The matrix to apply to the (included) raw pixels,
+            with shape (number of binned wavelengths,
+            number of included raw wavelengths)
+        """
+
+        # binning happens on a uniform grid of lnw
+        lnw = np.log(unbinned_w.value)
+        dnewlnw = 1.0 / R
+        newlnw = np.arange(np.nanmin(lnw), np.nanmax(lnw) + dnewlnw, dnewlnw)
+
+        # figure out how each raw pixel contributes to each binned one
+        if ok is not None:
+            lnw = lnw[ok]
+        matrix = calculate_resampling_matrix(
+            leftright_to_edges(*calculate_bin_leftright(lnw)),
+            leftright_to_edges(*calculate_bin_leftright(newlnw)),
+        )
+        return np.exp(newlnw) * unbinned_w.unit, matrix
+
+    def _create_grid(self, R, metallicity=0.0, remake=False, batch_size=16):
         """
         Create a pre-processed grid for a single resolution.
 
@@ -400,6 +775,8 @@ class PHOENIXLibrary:
             The stellar metallicity.
         remake : bool
             Should we remake the library even if a file exists?
+        batch_size : int
+            How many raw spectra should be binned at once?
         """
 
         # make sure that directory exists
@@ -410,14 +787,13 @@ class PHOENIXLibrary:
 
         try:
             assert self._current_raw_metallicity == metallicity
-            assert len(self._raw_spectrum_filenames) == len(self._raw_downloaded)
         except (AttributeError, AssertionError):
-            self._download_raw_data(metallicity=metallicity)
+            self._download_raw_index(metallicity=metallicity)
 
         # skip this resolution if already made
         filename = os.path.join(
             self._directory_for_new_grids,
-            self._get_grid_filename(R, metallicity=metallicity),
+            self._get_grid_filename(R, metallicity=metallicity, compressed=True),
         )
         if os.path.exists(filename) and (not remake):
             print(
@@ -447,44 +823,83 @@ class PHOENIXLibrary:
         for k, v in shared.items():
             print(f"{k:>20} = {v}")
 
-        d = {}
-        for k, v in tqdm(list(self._raw_downloaded.items()), leave=False):
-
-            # load the unbinned spectrum
-            unbinned_f = self._load_raw_spectrum(v)
-
-            # convert from W to photon/s
-            if self._are_the_units_photons:
-                photon_energy = (con.h * con.c / unbinned_w) / u.photon
-                unbinned_f = (unbinned_f / photon_energy).to("ph/(s m**2 nm)")
-            else:
-                unbinned_f = unbinned_f.to("W/(m**2 nm)")
-            # figure out its stellar inputs
-            T, logg, Z = self._get_Tgz_from_filename(k)
-            if R == "original":
-                w = unbinned_w
-                f = unbinned_f
-            else:
-                binned = bintoR(unbinned_w, unbinned_f, R=R, drop_nans=False)
-                w, f = binned["x"], binned["y"]
-
-            if "wavelength" not in shared:
-                shared["wavelength"] = w.value
-
-            assert len(f) == len(shared["wavelength"])
+        # the binning is identical for every spectrum, so set it up once
+        if R == "original":
+            w = unbinned_w
+        else:
+            w, binning_matrix = self._create_binning_matrix(unbinned_w, R)
+            assert binning_matrix.shape == (len(w), len(unbinned_w))
+            binning_weights = binning_matrix @ np.ones((len(unbinned_w), 1))
+
+        # single precision is plenty for the models (and halves the file size),
+        # but the small wavelength array stays in double precision, like older grids
+        shared["dtype"] = "float32"
+        shared["wavelength"] = w.value
+
+        # figure out the grid coordinates of all the raw spectra
+        N = len(self._raw_spectrum_filenames)
+        keys = np.asarray(
+            [self._get_Tgz_from_filename(k) for k in self._raw_spectrum_filenames]
+        )
+        for i, k in enumerate(self._keys_for_indexing):
+            shared[k] = np.unique(keys[:, i])
 
-            key = (T, logg, Z)
-            d[key] = f.value
+        # the unit conversion is identical for every spectrum, so calculate it once
+        if self._are_the_units_photons:
+            spectrum_unit = u.Unit("ph/(s m**2 nm)")
+            photon_energy = (con.h * con.c / unbinned_w) / u.photon
+            conversion = (u.Unit("W/(m**2 nm)") / photon_energy).to(spectrum_unit).value
+        else:
+            spectrum_unit = u.Unit("W/(m**2 nm)")
+            conversion = 1.0
+
+        # create an empty grid, to be filled with spectra
+        shape = tuple(len(shared[k]) for k in self._keys_for_indexing)
+        shared["available"] = np.zeros(shape, dtype=bool)
+        cube = np.full(shape + (len(w),), np.nan, dtype=shared["dtype"])
+
+        # download + load spectra in the background, while binning them here
+        # (closing it stops the background threads, even if something goes wrong)
+        with contextlib.closing(self._load_raw_spectra_in_background()) as raw:
+            for _ in tqdm(range(0, N, batch_size), leave=False):
+                batch = list(itertools.islice(raw, batch_size))
+
+                # (maybe) convert the unbinned spectra from W to photon/s
+                unbinned_fluxes = np.array([f * conversion for k, f in batch])
+
+                # bin the whole batch of spectra at once
+                if R == "original":
+                    binned_fluxes = unbinned_fluxes
+                else:
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        binned_fluxes = (
+                            (binning_matrix @ unbinned_fluxes.T) / binning_weights
+                        ).T
+
+                    # spectra with nans need their own matrix, to match `bintoR`
+                    for j in np.flatnonzero(np.any(np.isnan(unbinned_fluxes), axis=1)):
+                        ok = np.isnan(unbinned_fluxes[j]) == False
+                        if np.any(ok):
+                            _, m = self._create_binning_matrix(unbinned_w, R, ok=ok)
+                            with np.errstate(divide="ignore", invalid="ignore"):
+                                binned_fluxes[j] = (m @ unbinned_fluxes[j][ok]) / (
+                                    m @ np.ones(np.sum(ok))
+                                )
+                        else:
+                            binned_fluxes[j] = np.nan
 
-        # pull out the unique values of the keys
-        for i, k in enumerate(self._keys_for_indexing):
-            shared[k] = np.unique([x[i] for x in d])
+                for (k, _), f in zip(batch, binned_fluxes):
+                    # store it in the grid, at the index of its stellar inputs
+                    key = self._get_Tgz_from_filename(k)
+                    i = self._get_indices(key, metadata=shared)
+                    cube[i] = f
+                    shared["available"][i] = True
 
         shared["wavelength_unit"] = w.unit.to_string()
-        shared["spectrum_unit"] = f.unit.to_string()
+        shared["spectrum_unit"] = spectrum_unit.to_string()
 
-        # save everything to an easy-to-load file
-        np.save(filename, [shared, d], allow_pickle=True)
+        # save the grid and its metadata together, compressed to be quicker to download
+        np.savez_compressed(filename, cube=cube, **shared)
         print(f"That grid has been saved to {filename}.\n")
 
     def _find_smallest_R(self, R):
@@ -524,14 +939,31 @@ class PHOENIXLibrary:
         return smallest_sufficient_R
 
     def _get_local_grid(self, R, metallicity=0.0, directory="."):
-        bespoke = os.path.join(
-            self._directory_for_new_grids,
-            self._get_grid_filename(R, metallicity=metallicity),
-        )
-        if os.path.exists(bespoke):
-            return bespoke
-        else:
-            return self._download_grid(R, metallicity=metallicity)
+        """
+        Find the local file for a grid, downloading it if necessary.
+
+        Parameters
+        ----------
+        R : float
+            The resolution of the grid.
+        metallicity : float
+            The stellar metallicity.
+
+        Returns
+        -------
+        filename : str
+            The path to the local file for the grid.
+        """
+        for compressed in [True, False]:
+            bespoke = os.path.join(
+                self._directory_for_new_grids,
+                self._get_grid_filename(
+                    R, metallicity=metallicity, compressed=compressed
+                ),
+            )
+            if os.path.exists(bespoke):
+                return bespoke
+        return self._download_grid(R, metallicity=metallicity)
 
     def _load_grid(self, R, metallicity=0.0):
         """
@@ -551,60 +983,222 @@ class PHOENIXLibrary:
         except (AttributeError, AssertionError):
             pass
 
-        metadata, models = np.load(
-            self._get_local_grid(R, metallicity=metallicity), allow_pickle=True
-        )[()]
+        filename = self._get_local_grid(R, metallicity=metallicity)
+        if zipfile.is_zipfile(filename):
+            with np.load(filename) as loaded:
+                metadata = {k: loaded[k][()] for k in loaded.files if k != "cube"}
+            cube = self._load_compressed_cube(filename, metadata["filename"])
+        else:
+            # older grids store a dictionary of spectra, instead of one array
+            loaded = np.load(filename, allow_pickle=True)[()]
+            metadata, cube = self._convert_models_to_cube(*loaded)
 
         try:
-            for k in ["R", "photons", "wavelength"]:
+            for k in ["R", "photons"]:
                 assert np.all(self.metadata[k] == metadata[k])
-            for k in ["metallicity", "filename", "chromatic-version"]:
-                self.metadata[k] = np.hstack([self.metadata[k], metadata[k]])
-            self.models.update(**models)
+
+            # (allow for grids with wavelengths stored in different precision)
+            assert np.shape(self.metadata["wavelength"]) == np.shape(
+                metadata["wavelength"]
+            )
+            assert np.allclose(
+                self.metadata["wavelength"], metadata["wavelength"], rtol=1e-6, atol=0
+            )
+            self._combine_grids(metadata, cube)
 
         except (AttributeError, AssertionError):
             self.metadata = metadata
-            self.models = models
-            self.wavelength_cached_models = {}
+            self.cube = cube
+
+        # grid indices may have changed, so start a fresh cache
+        self.wavelength_cached_models = {}
 
         self.units = {
             k: u.Unit(self.metadata[f"{k}_unit"]) for k in ["wavelength", "spectrum"]
         }
-        self.wavelength = self.metadata["wavelength"] * self.units["wavelength"]
+        # (some grids store wavelengths in single precision, but hand out double)
+        self.wavelength = (
+            np.asarray(self.metadata["wavelength"], dtype=float)
+            * self.units["wavelength"]
+        )
+
+    def _load_compressed_cube(self, filename, basename):
+        """
+        Load the array of spectra from a compressed grid.
+
+        Small grids are simply loaded into memory. Large grids
+        (up to a few GB each, at the highest resolutions) are
+        extracted once into an uncompressed file in the cache
+        directory, so they can be memory-mapped; that takes as
+        much extra disk space as the uncompressed array, which
+        `.get_cache_size()` includes and `.clear_uncompressed_grids()`
+        can delete.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the compressed grid.
+        basename : str
+            The original filename of the compressed grid.
+
+        Returns
+        -------
+        cube : array
+            The spectra, with shape
+            (temperature, logg, metallicity, wavelength)
+        """
+        with zipfile.ZipFile(filename) as z:
+            size = z.getinfo("cube.npy").file_size
+        if size <= self._maximum_grid_size_to_load_into_memory:
+            with np.load(filename) as loaded:
+                return loaded["cube"]
+
+        directory = self._get_uncompressed_grid_dir()
+        os.makedirs(directory, exist_ok=True)
+
+        # (grids with the same name from different places shouldn't collide)
+        path_hash = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:12]
+        uncompressed_filename = os.path.join(
+            directory, basename.replace(".npz", f"_{path_hash}_cube.npy")
+        )
+
+        # reuse an existing uncompressed file, if it's up to date
+        try:
+            assert os.path.getsize(uncompressed_filename) == size
+            assert os.path.getmtime(uncompressed_filename) >= os.path.getmtime(filename)
+        except (OSError, AssertionError):
+            # stream the array straight to disk, without holding it in memory
+            temporary_filename = f"{uncompressed_filename}.{os.getpid()}.tmp"
+            with zipfile.ZipFile(filename) as z, z.open("cube.npy") as source, open(
+                temporary_filename, "wb"
+            ) as destination:
+                shutil.copyfileobj(source, destination, length=2**24)
+            os.replace(temporary_filename, uncompressed_filename)
+
+        return np.load(uncompressed_filename, mmap_mode="r")
+
+    def _get_indices(self, key, metadata=None):
+        """
+        Convert grid point coordinates into indices in the grid.
+
+        Parameters
+        ----------
+        key : tuple
+            The (temperature, logg, metallicity) of the grid point.
+        metadata : dict
+            The metadata defining the axes of the grid.
+            If None, use the currently loaded grid.
+
+        Returns
+        -------
+        indices : tuple
+            The (temperature, logg, metallicity) indices.
+        """
+        if metadata is None:
+            metadata = self.metadata
+        return tuple(
+            int(np.searchsorted(metadata[k], v))
+            for k, v in zip(self._keys_for_indexing, key)
+        )
+
+    def _convert_models_to_cube(self, metadata, models):
+        """
+        Convert an older dictionary of model spectra into a grid.
+
+        Parameters
+        ----------
+        metadata : dict
+            The metadata describing the grid.
+        models : dict
+            Spectra, with (temperature, logg, metallicity) keys.
+
+        Returns
+        -------
+        metadata : dict
+            The metadata, including which grid points are available.
+        cube : array
+            The spectra, with shape
+            (temperature, logg, metallicity, wavelength)
+        """
+        shape = tuple(len(metadata[k]) for k in self._keys_for_indexing)
+        dtype = next(iter(models.values())).dtype
+        metadata["available"] = np.zeros(shape, dtype=bool)
+        cube = np.full(shape + (len(metadata["wavelength"]),), np.nan, dtype=dtype)
+        for key, f in models.items():
+            i = self._get_indices(key, metadata=metadata)
+            cube[i] = f
+            metadata["available"][i] = True
+        return metadata, cube
+
+    def _combine_grids(self, metadata, cube):
+        """
+        Add a newly loaded grid into the currently loaded one
+        (for example, to include multiple metallicities).
+
+        Parameters
+        ----------
+        metadata : dict
+            The metadata describing the new grid.
+        cube : array
+            The spectra in the new grid.
+        """
+
+        # the combined grid needs all the grid points from both
+        combined = {}
+        for k in self._keys_for_indexing:
+            combined[k] = np.union1d(self.metadata[k], metadata[k])
+        shape = tuple(len(combined[k]) for k in self._keys_for_indexing)
+        available = np.zeros(shape, dtype=bool)
+        combined_cube = np.full(
+            shape + (cube.shape[-1],), np.nan, dtype=np.result_type(self.cube, cube)
+        )
+
+        # place each grid at its own indices within the combined grid
+        for m, c in [(self.metadata, self.cube), (metadata, cube)]:
+            i = np.ix_(
+                *[np.searchsorted(combined[k], m[k]) for k in self._keys_for_indexing]
+            )
+            combined_cube[i] = c
+            available[i] = m["available"]
+
+        self.metadata.update(**combined)
+        self.metadata["available"] = available
+        for k in ["filename", "chromatic-version"]:
+            self.metadata[k] = np.hstack([self.metadata[k], metadata[k]])
+        self.cube = combined_cube
 
     def _find_bounds(self, value, key, inputs={}):
         """
-        Find a mask where `possible` is immediately
+        Find the indices of the grid points immediately
         below or above `value`.
 
         Parameters
         ----------
         value : float
             The exact values to find.
-        possible : array
-            The possible grid point values to compare to.
+        key : str
+            The grid axis to search along
+            (temperature, logg, metallicity).
+        inputs : dict
+            The requested coordinate (for error messages).
 
         Returns
         -------
-         :
+        indices : list
+            One index if `value` is exactly on a grid point,
+            otherwise the indices below and above `value`.
         """
         possible = self.metadata[key]
 
+        # the axes are sorted, so do a binary search
+        i = np.searchsorted(possible, value, side="right")
+
         # return one index where it's exact
-        if value in possible:
-            return [value]
+        if (i > 0) and (possible[i - 1] == value):
+            return [i - 1]
 
         # figure out above and below grid points otherwise
-        try:
-            above = np.min(possible[possible > value])
-        except ValueError:
-            above = None
-        try:
-            below = np.max(possible[possible <= value])
-        except ValueError:
-            below = None
-
-        if (above is None) or (below is None):
+        if (i == 0) or (i == len(possible)):
             raise ValueError(
                 f"""
             Your requested coordinate of
@@ -615,7 +1209,122 @@ class PHOENIXLibrary:
             """
             )
         else:
-            return below, above
+            return [i - 1, i]
+
+    def _make_sure_grid_is_loaded(
+        self, R=100, metallicity=0.0, wavelength=None, wavelength_edges=None
+    ):
+        """
+        Make sure a grid is loaded that can support the
+        requested resolution (or wavelengths) and metallicities.
+
+        Parameters
+        ----------
+        R : float, optional
+            Spectroscopic resolution (lambda/dlambda).
+        metallicity : float, array, optional
+            One or more metallicities log10[metals/solar].
+        wavelength : Quantity, optional
+            A custom grid of wavelength centers.
+        wavelength_edges : Quantity, optional
+            A custom grid of wavelength edges.
+        """
+        metallicity = np.atleast_1d(metallicity)
+
+        # this kludgy business is to try to avoid loading multiple metallicities unless absolutely necessary
+        try:
+            # if no wavelength grids are provided, just go with R
+            if (wavelength is None) and (wavelength_edges is None):
+                assert self.metadata["R"] == R
+            # if wavelength grids are provided, make sure the grid has high enough R
+            else:
+                # make sure ask only for one type of wavelength
+                assert (wavelength is None) or (wavelength_edges is None)
+
+                # figure out the minimum R that'd be enough
+                if wavelength is None:
+                    necessary_R = self._wavelengths_to_R(wavelength_edges)
+                elif wavelength_edges is None:
+                    necessary_R = self._wavelengths_to_R(wavelength)
+
+                try:
+                    assert self.metadata.get("R", 0) >= necessary_R
+                except (AttributeError, AssertionError):
+                    R = self._find_smallest_R(necessary_R)
+                    assert False
+
+            assert (np.min(metallicity) >= np.min(self.metadata["metallicity"])) and (
+                np.max(metallicity) <= np.max(self.metadata["metallicity"])
+            )
+        except (AttributeError, AssertionError):
+            if np.all(np.isin(metallicity, self._available_metallicities)):
+                for m in np.unique(metallicity):
+                    self._load_grid(
+                        self._find_smallest_R(R=R),
+                        metallicity=m,
+                    )
+            else:
+                for m in self._available_metallicities:
+                    self._load_grid(
+                        self._find_smallest_R(R=R),
+                        metallicity=m,
+                    )
+
+    def _find_many_bounds(self, values, key, logarithmic=False):
+        """
+        Find the indices of the grid points immediately
+        below and above many values at once, along with
+        the weights needed to interpolate between them.
+
+        Parameters
+        ----------
+        values : array
+            The exact values to find.
+        key : str
+            The grid axis to search along
+            (temperature, logg, metallicity).
+        logarithmic : bool
+            Should the interpolation weights be
+            calculated in log(value)?
+
+        Returns
+        -------
+        indices : array
+            The (N, 2) indices of the grid points below and
+            above each value. (If a value is exactly on a grid
+            point, the second one will have zero weight.)
+        weights : array
+            The (N, 2) interpolation weights for those grid points.
+        """
+        possible = self.metadata[key]
+
+        # the axes are sorted, so do a binary search
+        i = np.searchsorted(possible, values, side="right")
+        outside = (i == 0) | ((i == len(possible)) & (values != possible[-1]))
+        if np.any(outside):
+            raise ValueError(
+                f"""
+            Your requested {key} of
+            {values[outside]}
+            is outside the limits {np.min(possible)}<={key}<{np.max(possible)}.
+            Please rewrite your code to avoid this happening
+            or proceed very, very, very, very cautiously.
+            """
+            )
+        below = np.clip(i - 1, 0, max(len(possible) - 2, 0))
+        above = np.minimum(below + 1, len(possible) - 1)
+
+        if logarithmic:
+            x, possible = np.log(values), np.log(possible)
+        else:
+            x = values
+        span = possible[above] - possible[below]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight_above = np.where(span > 0, (x - possible[below]) / span, 0.0)
+        return (
+            np.transpose([below, above]),
+            np.transpose([1 - weight_above, weight_above]),
+        )
 
     def _get_interpolation_weights(self, value, bounds):
         """
@@ -675,8 +1384,26 @@ class PHOENIXLibrary:
         return (np.min(w), np.max(w), len(w))
 
     def _get_spectrum_from_grid(self, key, wavelength=None, wavelength_edges=None):
+        """
+        Get the spectrum at one grid point, possibly
+        binned onto a custom wavelength grid.
+
+        Parameters
+        ----------
+        key : tuple
+            The (temperature, logg, metallicity) indices of the grid point.
+        wavelength : Quantity, optional
+            A custom grid of wavelength centers.
+        wavelength_edges : Quantity, optional
+            A custom grid of wavelength edges.
+
+        Returns
+        -------
+        spectrum : array
+            The spectrum at that grid point (without units).
+        """
         if (wavelength is None) and (wavelength_edges is None):
-            return self.models[key]
+            return self.cube[key]
         else:
             # make sure ask only for one type of wavelength
             assert (wavelength is None) or (wavelength_edges is None)
@@ -699,12 +1426,51 @@ class PHOENIXLibrary:
             except KeyError:
                 self.wavelength_cached_models[wavelength_key][key] = bintogrid(
                     self.wavelength,
-                    self.models[key],
+                    self.cube[key],
                     newx=wavelength,
                     newx_edges=wavelength_edges,
                 )["y"]
                 return self.wavelength_cached_models[wavelength_key][key]
 
+    def _get_spectra_from_grid(self, indices, wavelength=None, wavelength_edges=None):
+        """
+        Get the spectra at a small block of neighboring grid points.
+
+        Parameters
+        ----------
+        indices : list
+            Three lists of consecutive (temperature, logg, metallicity) indices.
+        wavelength : Quantity, optional
+            A custom grid of wavelength centers.
+        wavelength_edges : Quantity, optional
+            A custom grid of wavelength edges.
+
+        Returns
+        -------
+        spectra : array
+            The spectra, with shape (temperature, logg, metallicity, wavelength)
+        """
+        if (wavelength is None) and (wavelength_edges is None):
+            return self.cube[tuple(slice(i[0], i[-1] + 1) for i in indices)]
+        else:
+            iT, ig, iZ = indices
+            return np.array(
+                [
+                    [
+                        [
+                            self._get_spectrum_from_grid(
+                                (t, g, z),
+                                wavelength=wavelength,
+                                wavelength_edges=wavelength_edges,
+                            )
+                            for z in iZ
+                        ]
+                        for g in ig
+                    ]
+                    for t in iT
+                ]
+            )
+
     def get_spectrum(
         self,
         temperature=5780,
@@ -759,43 +1525,12 @@ class PHOENIXLibrary:
             The surface flux in photon units
         """
 
-        # this kludgy business is to try to avoid loading multiple metallicities unless absolutely necessary
-        try:
-            # if no wavelength grids are provided, just go with R
-            if (wavelength is None) and (wavelength_edges is None):
-                assert self.metadata["R"] == R
-            # if wavelength grids are provided, make sure the grid has high enough R
-            else:
-                # make sure ask only for one type of wavelength
-                assert (wavelength is None) or (wavelength_edges is None)
-
-                # figure out the minimum R that'd be enough
-                if wavelength is None:
-                    necessary_R = self._wavelengths_to_R(wavelength_edges)
-                elif wavelength_edges is None:
-                    necessary_R = self._wavelengths_to_R(wavelength)
-
-                try:
-                    assert self.metadata.get("R", 0) >= necessary_R
-                except (AttributeError, AssertionError):
-                    R = self._find_smallest_R(necessary_R)
-                    assert False
-
-            assert (metallicity >= np.min(self.metadata["metallicity"])) and (
-                metallicity <= np.max(self.metadata["metallicity"])
-            )
-        except (AttributeError, AssertionError):
-            if metallicity in self._available_metallicities:
-                self._load_grid(
-                    self._find_smallest_R(R=R),
-                    metallicity=metallicity,
-                )
-            else:
-                for m in self._available_metallicities:
-                    self._load_grid(
-                        self._find_smallest_R(R=R),
-                        metallicity=m,
-                    )
+        self._make_sure_grid_is_loaded(
+            R=R,
+            metallicity=metallicity,
+            wavelength=wavelength,
+            wavelength_edges=wavelength_edges,
+        )
 
         # strip units
         if isinstance(temperature, u.Quantity):
@@ -804,14 +1539,31 @@ class PHOENIXLibrary:
         # store the inputs as a convenient dictionary to pass around
         inputs = dict(temperature=temperature, logg=logg, metallicity=metallicity)
 
-        # figure out the
-        bounding_temperature = self._find_bounds(
-            temperature, key="temperature", inputs=inputs
-        )
-        bounding_logg = self._find_bounds(logg, key="logg", inputs=inputs)
-        bounding_metallicity = self._find_bounds(
-            metallicity, key="metallicity", inputs=inputs
-        )
+        # figure out the grid points that surround the requested coordinate
+        indices = [
+            self._find_bounds(inputs[k], key=k, inputs=inputs)
+            for k in self._keys_for_indexing
+        ]
+        bounds = [self.metadata[k][i] for k, i in zip(self._keys_for_indexing, indices)]
+        bounding_temperature, bounding_logg, bounding_metallicity = bounds
+
+        # make sure all the surrounding grid points actually exist
+        available = self.metadata["available"][np.ix_(*indices)]
+        if not np.all(available):
+            key = tuple(
+                b[i] for b, i in zip(bounds, np.argwhere(available == False)[0])
+            )
+            raise ValueError(
+                f"""
+            The grid point coordinate {key} is needed to interpolate to your
+            requested coordinate {inputs},
+            but it's not available. This problem is probably caused by
+            requesting something near the jagged edge of the
+            grid's availability.
+
+            Please run `.plot_available()` to see what models are possible.
+            """
+            )
 
         if visualize:
             self.plot_available(**inputs)
@@ -824,9 +1576,12 @@ class PHOENIXLibrary:
         spectra = []
         if N == 1:
             weights = [1]
-            key = (bounding_temperature[0], bounding_logg[0], bounding_metallicity[0])
-            spectrum = self._get_spectrum_from_grid(
-                key, wavelength=wavelength, wavelength_edges=wavelength_edges
+            key = tuple(i[0] for i in indices)
+            spectrum = np.asarray(
+                self._get_spectrum_from_grid(
+                    key, wavelength=wavelength, wavelength_edges=wavelength_edges
+                ),
+                dtype=float,
             ).flatten()
         else:
             logT, bounding_logT = np.log(temperature), np.log(bounding_temperature)
@@ -836,41 +1591,24 @@ class PHOENIXLibrary:
                 metallicity, bounding_metallicity
             )
 
-            weights = np.zeros(N)
-            i = 0
-            for wt, t in zip(weight_temperature, bounding_temperature):
-                for wg, g in zip(weight_logg, bounding_logg):
-                    for wz, z in zip(weight_metallicity, bounding_metallicity):
-                        weights[i] = wt * wg * wz
-                        key = (t, g, z)
-                        try:
-                            with warnings.catch_warnings():
-                                warnings.simplefilter("ignore")
-                                this_log_spectrum = np.log(
-                                    self._get_spectrum_from_grid(
-                                        key,
-                                        wavelength=wavelength,
-                                        wavelength_edges=wavelength_edges,
-                                    )
-                                )
-                        except KeyError:
-                            raise ValueError(
-                                f"""
-                            The grid point coordinate {key} is needed to interpolate to your
-                            requested coordinate {inputs},
-                            but it's not available. This problem is probably caused by
-                            requesting something near the jagged edge of the
-                            grid's availability.
-
-                            Please run `.plot_available()` to see what models are possible.
-                            """
-                            )
-                        spectra.append(this_log_spectrum)
-                        # print(f"{weights[i]} * [{key}]")
-                        i += 1
+            weights_per_axis = [
+                np.asarray(w, dtype=float)
+                for w in [weight_temperature, weight_logg, weight_metallicity]
+            ]
+
+            # interpolate (in log space) among the surrounding grid points
+            grid_spectra = self._get_spectra_from_grid(
+                indices,
+                wavelength=wavelength,
+                wavelength_edges=wavelength_edges,
+            )
+            spectrum = _interpolate_log_spectra(grid_spectra, *weights_per_axis)
+
+            weights = np.einsum("i,j,k->ijk", *weights_per_axis).flatten()
+            if visualize:
+                spectra = grid_spectra.reshape(N, -1)
             weight_sum = np.sum(weights)
             assert np.isclose(weight_sum, 1)
-            spectrum = np.exp(np.sum(weights[:, np.newaxis] * spectra, axis=0))
 
         if wavelength is None:
             if wavelength_edges is None:
@@ -881,7 +1619,7 @@ class PHOENIXLibrary:
         if visualize:
             fi = plt.figure(figsize=(8, 3))
             for w, s in zip(weights, spectra):
-                plt.plot(wavelength, np.exp(s), alpha=w)
+                plt.plot(wavelength, s, alpha=w)
             plt.plot(wavelength, spectrum, color="black")
             plt.xlabel(
                 f"Wavelength ({self.units['wavelength'].to_string('latex_inline')})"
@@ -893,6 +1631,142 @@ class PHOENIXLibrary:
 
         return wavelength, spectrum * self.units["spectrum"]
 
+    def get_spectra(
+        self,
+        temperature=5780,
+        logg=4.43,
+        metallicity=0.0,
+        R=100,
+        wavelength=None,
+        wavelength_edges=None,
+    ):
+        """
+        Get PHOENIX model spectra for many temperatures, loggs, metallicities.
+
+        This does the same interpolation as `get_spectrum`, but for
+        a whole batch of stellar parameters at once, which is much
+        faster than calling `get_spectrum` in a loop.
+
+        Parameters
+        ----------
+        temperature : float, array, optional
+            Temperatures, in K (with no astropy units attached).
+        logg : float, array, optional
+            Surface gravities log10[g/(cm/s**2)] (with no astropy units attached).
+        metallicity : float, array, optional
+            Metallicities log10[metals/solar] (with no astropy units attached).
+        R : float, optional
+            Spectroscopic resolution (lambda/dlambda). See `get_spectrum`.
+        wavelength : Quantity, optional
+            A grid of wavelengths on which you would like your spectra.
+            See `get_spectrum`.
+        wavelength_edges : Quantity, optional
+            Same as `wavelength` (see above!) but defining the wavelength
+            grid by its edges instead of its centers.
+
+        Returns
+        -------
+        wavelength : Quantity
+            The wavelengths, at the specified resolution.
+        spectra : Quantity
+            The surface fluxes, with shape (N, wavelength), where
+            N is the broadcast size of the stellar parameters.
+        """
+
+        # strip units
+        if isinstance(temperature, u.Quantity):
+            temperature = temperature.value
+
+        # make sure all the inputs are arrays of the same size
+        inputs = dict(
+            zip(
+                self._keys_for_indexing,
+                np.broadcast_arrays(
+                    *[
+                        np.atleast_1d(x).astype(float).flatten()
+                        for x in [temperature, logg, metallicity]
+                    ]
+                ),
+            )
+        )
+
+        self._make_sure_grid_is_loaded(
+            R=R,
+            metallicity=inputs["metallicity"],
+            wavelength=wavelength,
+            wavelength_edges=wavelength_edges,
+        )
+
+        # figure out the grid points and weights for every requested coordinate
+        indices, weights = zip(
+            *[
+                self._find_many_bounds(
+                    inputs[k], key=k, logarithmic=(k == "temperature")
+                )
+                for k in self._keys_for_indexing
+            ]
+        )
+
+        # add up (in log space) the contributions from each surrounding corner
+        log_spectra = 0.0
+        for corner in np.ndindex(2, 2, 2):
+            i = [x[:, c] for x, c in zip(indices, corner)]
+            w = np.prod([x[:, c] for x, c in zip(weights, corner)], axis=0)
+            needed = w > 0
+
+            # make sure all the necessary grid points actually exist
+            missing = needed & (self.metadata["available"][tuple(i)] == False)
+            if np.any(missing):
+                m = np.flatnonzero(missing)[0]
+                key = tuple(self.metadata[k][x[m]] for k, x in zip(inputs, i))
+                coordinate = {k: x[m] for k, x in inputs.items()}
+                raise ValueError(
+                    f"""
+                The grid point coordinate {key} is needed to interpolate to your
+                requested coordinate {coordinate},
+                but it's not available. This problem is probably caused by
+                requesting something near the jagged edge of the
+                grid's availability.
+
+                Please run `.plot_available()` to see what models are possible.
+                """
+                )
+
+            # skip corners that no requested coordinate depends on
+            if not np.any(needed):
+                continue
+
+            if (wavelength is None) and (wavelength_edges is None):
+                grid_spectra = self.cube[tuple(x[needed] for x in i)]
+            else:
+                grid_spectra = np.array(
+                    [
+                        self._get_spectrum_from_grid(
+                            key,
+                            wavelength=wavelength,
+                            wavelength_edges=wavelength_edges,
+                        )
+                        for key in zip(*[x[needed] for x in i])
+                    ]
+                ).reshape(np.sum(needed), -1)
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                contribution = np.zeros((len(w), grid_spectra.shape[-1]))
+                contribution[needed] = w[needed, np.newaxis] * np.log(
+                    grid_spectra, dtype=float
+                )
+            log_spectra = log_spectra + contribution
+        spectra = np.exp(log_spectra)
+
+        if wavelength is None:
+            if wavelength_edges is None:
+                wavelength = self.wavelength
+            else:
+                wavelength = 0.5 * (wavelength_edges[:-1] + wavelength_edges[1:])
+
+        return wavelength, spectra * self.units["spectrum"]
+
     def plot_available(self, temperature=None, logg=None, metallicity=None):
         """
         Make plots indicating the available grid points
@@ -917,12 +1791,19 @@ class PHOENIXLibrary:
             metallicity="[Fe/H] (metallicity)",
         )
         gridkw = dict(marker=".", alpha=0.3)
+
+        # the coordinates of every available grid point, along each axis
+        grid = np.meshgrid(
+            *[self.metadata[k] for k in self._keys_for_indexing], indexing="ij"
+        )
+        available = {
+            k: g[self.metadata["available"]]
+            for k, g in zip(self._keys_for_indexing, grid)
+        }
         for i, ky in enumerate(self._keys_for_indexing):
             for j, kx in enumerate(self._keys_for_indexing):
-                y = [k[i] for k in self.models]
-                x = [k[j] for k in self.models]
                 plt.sca(ax[i, j])
-                plt.scatter(x, y, **gridkw)
+                plt.scatter(available[kx], available[ky], **gridkw)
                 plt.scatter(locals()[kx], locals()[ky])
                 # if j == 0:
                 plt.ylabel(labels[ky])
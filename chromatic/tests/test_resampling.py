@@ -130,3 +130,17 @@ def test_bintogrid(N_original=23):
                 plt.title(f"bin by {nx} bins, {label}")
                 save_binning_example_figure()
     plt.close("all")
+
+
+def test_resampling_matrix():
+    for N, N_new in [(11, 29), (29, 11)]:
+        x_edges = np.sort(np.random.uniform(2, 4, N + 1))
+        y = np.random.normal(3, 0.5, N)
+        x_new_edges = np.linspace(1.6, 4.3, N_new + 1)
+
+        expected = resample_while_conserving_flux(
+            yin=y, xin_edges=x_edges, xout_edges=x_new_edges
+        )
+        matrix = calculate_resampling_matrix(x_edges, x_new_edges)
+        assert matrix.shape == (N_new, N)
+        assert np.all(np.isclose(matrix @ y, expected["y"]))
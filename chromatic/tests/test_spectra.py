@@ -1,6 +1,7 @@
 from .setup_tests import *
 from ..imports import *
 from ..spectra import *
+from ..resampling import bintoR
 
 
 def test_spectral_library_R(cmap=one2another("indigo", "tomato"), N=5):
@@ -77,3 +78,214 @@ def test_spectral_library_loads_correct_R():
             "demonstration-of-spectral-library-loading-minimum-necessary-resolution.pdf",
         )
     )
+
+
+def test_phoenix_filenames():
+    library = PHOENIXLibrary()
+    for key in [(3000.0, 4.5, 0.0), (5800.0, 4.0, -0.5), (12000.0, 5.5, 1.0)]:
+        filename = library._get_filename_from_Tgz(*key)
+        assert library._get_Tgz_from_filename(filename) == key
+
+
+def test_spectral_library_batch():
+    temperatures = np.array([3000.0, 3456.0, 5780.0])
+    w, spectra = phoenix_library.get_spectra(
+        temperature=temperatures, logg=4.5, metallicity=0.0, R=100
+    )
+    assert spectra.shape == (len(temperatures), len(w))
+    for T, s in zip(temperatures, spectra):
+        _, expected = get_phoenix_photons(temperature=T, logg=4.5, R=100)
+        assert np.all(np.isclose(s, expected, equal_nan=True))
+
+    # (with a grid point along some axes, so some corners aren't needed)
+    wavelength = np.linspace(0.3, 3, 50) * u.micron
+    loggs = np.array([4.5, 4.2, 4.0])
+    w, spectra = phoenix_library.get_spectra(
+        temperature=temperatures,
+        logg=loggs,
+        metallicity=0.0,
+        R=100,
+        wavelength=wavelength,
+    )
+    assert spectra.shape == (len(temperatures), len(wavelength))
+    for T, g, s in zip(temperatures, loggs, spectra):
+        _, expected = phoenix_library.get_spectrum(
+            temperature=T, logg=g, metallicity=0.0, R=100, wavelength=wavelength
+        )
+        assert np.all(np.isclose(s, expected, equal_nan=True))
+
+
+def test_fast_read_phoenix():
+    from ..spectra.phoenix import _fast_read_phoenix
+
+    filename = os.path.join(test_directory, "fake-phoenix-spectrum.fits")
+    for dtype in [np.float32, np.float64]:
+        data = np.random.uniform(0, 1e15, 12345).astype(dtype)
+        hdu = fits.PrimaryHDU(data)
+        for i in range(50):
+            hdu.header[f"PHX{i}"] = i
+        hdu.writeto(filename, overwrite=True)
+        assert np.all(_fast_read_phoenix(filename) == fits.getdata(filename))
+
+
+def test_interpolate_log_spectra():
+    from ..spectra.phoenix import (
+        _interpolate_log_spectra_numpy,
+        _interpolate_log_spectra_numba,
+    )
+
+    if _interpolate_log_spectra_numba is None:
+        pytest.skip("numba is not installed")
+
+    spectra = np.random.uniform(1e10, 1e20, (2, 2, 2, 100)).astype(np.float32)
+    spectra[0, 1, 0, 10] = np.nan
+    spectra[1, 0, 1, 20] = 0.0
+    weights = [np.array([0.3, 0.7]), np.array([0.6, 0.4]), np.array([0.5, 0.5])]
+    a = _interpolate_log_spectra_numpy(spectra, *weights)
+    b = _interpolate_log_spectra_numba(spectra, *weights)
+    assert np.isnan(a[10]) and (a[20] == 0)
+    assert np.allclose(a, b, rtol=1e-12, atol=0, equal_nan=True)
+
+
+def make_fake_phoenix_grids(directory, R=100, metallicities=[-0.5, 0.0]):
+    """
+    Create small PHOENIX grids without going online,
+    by binning fake raw spectra (with a jagged edge).
+    """
+    raw_directory = os.path.join(directory, "raw")
+    os.makedirs(raw_directory, exist_ok=True)
+    wavelength_filename = os.path.join(raw_directory, "WAVE.fits")
+    w = np.logspace(np.log10(500), np.log10(55000), 5000)
+    fits.PrimaryHDU(w).writeto(wavelength_filename, overwrite=True)
+
+    library = PHOENIXLibrary(directory=directory)
+    for metallicity in metallicities:
+        filenames = []
+        for temperature in [3000.0, 3100.0, 3200.0]:
+            for logg in [4.0, 4.5, 5.0]:
+                if (temperature, logg) == (3200.0, 5.0):
+                    continue
+                f = (w / 5000) ** -5 / (np.exp(1.4388e8 / (w * temperature)) - 1)
+                f *= 1e15 * (1 + 0.1 * logg + 0.1 * metallicity)
+                filename = library._get_filename_from_Tgz(
+                    temperature, logg, metallicity
+                )
+                fits.PrimaryHDU(f.astype(np.float32)).writeto(
+                    os.path.join(raw_directory, filename), overwrite=True
+                )
+                filenames.append(filename)
+
+        # pretend these have been downloaded from the PHOENIX database
+        library._raw_local_paths = {"wavelengths": wavelength_filename}
+        library._raw_spectrum_filenames = filenames
+        library._raw_spectrum_urls = [None for f in filenames]
+        library._raw_downloaded = {f: os.path.join(raw_directory, f) for f in filenames}
+        library._current_raw_metallicity = metallicity
+        library._create_grid(R, metallicity=metallicity, remake=True)
+
+
+def convert_to_old_phoenix_grid(directory, R=100, metallicity=0.0):
+    """
+    Rewrite a compressed grid in the older format, as a
+    pickled list of [metadata, dictionary of spectra].
+    """
+    library = PHOENIXLibrary(directory=directory)
+    compressed = os.path.join(
+        library._directory_for_new_grids,
+        library._get_grid_filename(R, metallicity=metallicity, compressed=True),
+    )
+    with np.load(compressed) as loaded:
+        metadata = {k: loaded[k][()] for k in loaded.files}
+    cube = metadata.pop("cube")
+    available = metadata.pop("available")
+    models = {}
+    for i in zip(*np.nonzero(available)):
+        key = tuple(metadata[k][j] for k, j in zip(library._keys_for_indexing, i))
+        models[key] = cube[i].astype(float)
+
+    # older grids had wavelengths straight from `bintoR`, in double precision
+    raw_w = fits.getdata(os.path.join(directory, "raw", "WAVE.fits")) * 1e-4
+    binned = bintoR(raw_w * u.micron, np.ones_like(raw_w), R=R, drop_nans=False)
+    metadata["wavelength"] = binned["x"].value
+    old = os.path.join(
+        library._directory_for_new_grids,
+        library._get_grid_filename(R, metallicity=metallicity),
+    )
+    np.save(old, [metadata, models], allow_pickle=True)
+    os.remove(compressed)
+
+
+def test_phoenix_merge_old_and_new_grids():
+    directory = os.path.join(test_directory, "fake-phoenix-old-and-new")
+    make_fake_phoenix_grids(directory)
+    convert_to_old_phoenix_grid(directory, metallicity=-0.5)
+
+    library = PHOENIXLibrary(directory=directory)
+    library._available_metallicities = [-0.5, 0.0]
+    w, f = library.get_spectrum(temperature=3050, logg=4.2, metallicity=-0.25, R=100)
+    assert list(library.metadata["metallicity"]) == [-0.5, 0.0]
+    assert np.any(np.isfinite(f))
+
+
+def test_phoenix_grid_offline():
+    directory = os.path.join(test_directory, "fake-phoenix-grids")
+    make_fake_phoenix_grids(directory)
+
+    def interpolate(**kw):
+        library = PHOENIXLibrary(directory=directory)
+        library._available_metallicities = [-0.5, 0.0]
+        for k, v in kw.items():
+            setattr(library, k, v)
+        w, f = library.get_spectrum(
+            temperature=3050, logg=4.2, metallicity=-0.25, R=100
+        )
+        assert library.metadata["available"].shape == (3, 3, 2)
+        assert np.sum(library.metadata["available"]) == 16
+
+        # the jagged edge of the grid should complain
+        with pytest.raises(ValueError):
+            library.get_spectrum(temperature=3150, logg=4.8, metallicity=0.0, R=100)
+        return f
+
+    # load compressed grids into memory, or uncompressed + memory-mapped
+    in_memory = interpolate()
+    memory_mapped = interpolate(_maximum_grid_size_to_load_into_memory=0)
+    assert np.array_equal(in_memory.value, memory_mapped.value, equal_nan=True)
+
+    # load grids in the older format
+    for metallicity in [-0.5, 0.0]:
+        convert_to_old_phoenix_grid(directory, metallicity=metallicity)
+    old = interpolate()
+    assert np.allclose(in_memory, old, rtol=1e-6, equal_nan=True)
+
+    # interpolating across metallicity should land between the grid points
+    library = PHOENIXLibrary(directory=directory)
+    library._available_metallicities = [-0.5, 0.0]
+    _, low = library.get_spectrum(temperature=3050, logg=4.2, metallicity=-0.5)
+    _, high = library.get_spectrum(temperature=3050, logg=4.2, metallicity=0.0)
+    ok = np.isfinite(in_memory)
+    assert np.any(ok)
+    assert np.all((in_memory[ok] > low[ok]) & (in_memory[ok] < high[ok]))
+
+
+def test_phoenix_binning_matrix():
+    library = PHOENIXLibrary()
+    w = np.sort(np.random.uniform(0.1, 5, 3000)) * u.micron
+    f = np.random.uniform(1, 2, len(w))
+    f_with_nans = f.copy()
+    f_with_nans[1000:1010] = np.nan
+    ok = np.isnan(f_with_nans) == False
+    for R in [10, 100, 1000, 100000]:
+        binned_w, matrix = library._create_binning_matrix(w, R)
+        expected = bintoR(w, f, R=R, drop_nans=False)
+        assert np.allclose(binned_w, expected["x"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            binned_f = (matrix @ f) / (matrix @ np.ones_like(f))
+        assert np.allclose(binned_f, expected["y"], equal_nan=True)
+
+        # nans should be left out, as the remaining pixels stretch across the gap
+        _, matrix = library._create_binning_matrix(w, R, ok=ok)
+        expected = bintoR(w, f_with_nans, R=R, drop_nans=False)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            binned_f = (matrix @ f[ok]) / (matrix @ np.ones(np.sum(ok)))
+        assert np.allclose(binned_f, expected["y"], equal_nan=True)